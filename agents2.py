@@ -1,99 +1,204 @@
 import agentpy as ap
-import random
-import pickle
+import numpy as np
+import json
 import os
+import pickle
 import matplotlib.pyplot as plt
 import time
 import sys
+import threading
+import heapq
+from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from numba import njit
+except ImportError:  # Numba es opcional: sin él los kernels corren como Python puro
+    def njit(*args, **kwargs):
+        if args and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+
+@njit(cache=True)
+def manhattan_min_and_argmin(px, py, positions):
+    """Distancia Manhattan mínima desde (px, py) a un arreglo Nx2 de posiciones y su índice"""
+    best_dist = -1
+    best_idx = -1
+    for i in range(positions.shape[0]):
+        dist = abs(px - positions[i, 0]) + abs(py - positions[i, 1])
+        if best_idx < 0 or dist < best_dist:
+            best_dist = dist
+            best_idx = i
+    return best_dist, best_idx
+
+
+# Acciones de los camiones; cada estado de la Q-table guarda un arreglo con un valor por acción
+ACTIONS = ("up", "down", "left", "right", "collect", "change_route")
+ACTION_IDX = {action: i for i, action in enumerate(ACTIONS)}
+
+# Estados de la Q-table empaquetados en un int: x (3 bits) | y (3 bits) | carga (16 bits)
+MAX_PACKED_LOAD = 0xFFFF  # Una capacidad mayor pisaría los bits de y y corrompería las claves de la Q-table
+
+def pack_state(position, load):
+    x, y = position
+    return (x << 19) | (y << 16) | load
+
+
+def unpack_state(state):
+    return ((state >> 19) & 0x7, (state >> 16) & 0x7), state & 0xFFFF
+
+
+# Puntos de descarga (esquinas del grid)
+DUMP_POINTS = np.array([(0, 0), (7, 0), (0, 7), (7, 7)], dtype=np.int32)
+
 
 # --------------------------
 # Trash Container Agent
 class TrashContainerAgent(ap.Agent):
-    def setup(self):
-        self.position = None
-        self.capacity = self.p.container_limit
-        self.current_fill = 0
-        self.generation_rate = 0
-    
-    def step(self):
-        if random.uniform(0, 1) < self.p.population_density:
-            if self.p.population_density >= 0.3:
-                basura_generada = random.randint(2, 5)
-            else:
-                basura_generada = random.randint(1, 3)
-            self.current_fill = min(self.current_fill + basura_generada, self.capacity * 2)
+    """Vista ligera sobre los arreglos SoA del modelo (fill, cap, pos)"""
+
+    def setup(self, index):
+        self.index = index  # Posición del contenedor en los arreglos del modelo
+
+    @property
+    def position(self):
+        return self.model.container_positions[self.index]
+
+    @property
+    def capacity(self):
+        return int(self.model.cap[self.index])
+
+    @property
+    def current_fill(self):
+        return int(self.model.fill[self.index])
+
+    @current_fill.setter
+    def current_fill(self, value):
+        self.model.fill[self.index] = value
     
     def collect_trash(self, amount):
-        collected = min(self.current_fill, amount)
-        self.current_fill -= collected
-        return collected
+        """Recolecta hasta `amount`; devuelve lo recolectado y si el contenedor sigue crítico"""
+        # Revisar, restar y leer el estado en una sola sección: con camiones en paralelo,
+        # otro camión no puede vaciar el contenedor entre la revisión y la recolección
+        with self.model.collect_lock:
+            was_critical, was_overflowing = self.is_critical(), self.is_overflowing()
+            collected = min(self.current_fill, amount)
+            self.current_fill -= collected
+            is_critical = self.is_critical()
+            # Solo recalcular el caché del modelo si el contenedor cambió de estado
+            if (was_critical, was_overflowing) != (is_critical, self.is_overflowing()):
+                self.model.update_status_cache()
+        return collected, is_critical
     
     def is_critical(self):
-        return self.current_fill >= 0.9 * self.capacity
+        return bool(self.model.fill[self.index] >= self.model.critical_thr[self.index])
     
     def is_overflowing(self):
-        return self.current_fill >= self.capacity
+        return bool(self.model.fill[self.index] >= self.model.cap[self.index])
 
 
 # --------------------------
 # Trash Truck Agent
 class TrashTruckAgent(ap.Agent):
+    POSSIBLE_ACTIONS = ACTIONS
 
-    def setup(self):
+    def setup(self, truck_id=0, position=(0, 0)):
         self.capacity = self.p.capacity
+        if not 0 < self.capacity <= MAX_PACKED_LOAD:
+            raise ValueError(f"Truck capacity must be between 1 and {MAX_PACKED_LOAD}, got {self.capacity}")
+        self._dump_thr = self.capacity * 0.8  # Descargar cuando esté al 80%
         self.load = 0
-        self.position = (0, 0)
+        self.position = position
         self.q_table = {}
         self.epsilon = self.p.epsilon
         self.alpha = self.p.alpha
         self.gamma = self.p.gamma
-        self.truck_id = 0  # Se asignará en el modelo
+        self.truck_id = truck_id  # Asignado por el modelo antes de cargar la Q-table
+        self.training_runs = 0
+        self._q_sum = 0.0  # Suma y cantidad de Q-valores, actualizadas de forma incremental en update_q
+        self._n_values = 0
         
         # Cargar Q-table si existe
         self.load_q_table()
 
     def load_q_table(self):
         """Carga la Q-table desde archivo si existe"""
-        filename = f"q_table_truck_{self.truck_id}.pkl"
-        if os.path.exists(filename):
+        meta_filename = f"q_truck_{self.truck_id}.meta.json"
+        if os.path.exists(meta_filename):
             try:
-                with open(filename, 'rb') as f:
-                    saved_data = pickle.load(f)
-                    self.q_table = saved_data['q_table']
-                    # Mantener epsilon alto para seguir explorando
-                    self.epsilon = max(0.2, saved_data.get('epsilon', self.epsilon) * 0.98)  # Reducción más lenta
-                    print(f"🔄 Camión {self.truck_id}: Q-table cargada con {len(self.q_table)} estados, epsilon={self.epsilon:.3f}")
+                # Metadatos pequeños (epsilon, ejecuciones) en JSON; los Q-valores en arreglos .npz
+                with open(meta_filename) as f:
+                    meta = json.load(f)
+                with np.load(f"q_truck_{self.truck_id}.npz") as data:
+                    states, q_values = data['states'], data['qvals']
+                # Cada estado apunta a una fila del mismo arreglo (S, 6)
+                self.q_table = dict(zip(states.tolist(), q_values))
+                self._q_sum = float(q_values.sum(dtype=np.float64))
+                self._n_values = q_values.size
+                # Mantener epsilon alto para seguir explorando
+                self.epsilon = max(0.2, meta.get('epsilon', self.epsilon) * 0.98)  # Reducción más lenta
+                self.training_runs = meta.get('training_runs', 0)
+                print(f"🔄 Camión {self.truck_id}: Q-table cargada con {len(self.q_table)} estados, epsilon={self.epsilon:.3f}")
             except Exception as e:
                 print(f"⚠️ Error cargando Q-table para camión {self.truck_id}: {e}")
+        elif os.path.exists(f"q_table_truck_{self.truck_id}.pkl"):
+            self.load_legacy_q_table(f"q_table_truck_{self.truck_id}.pkl")
+
+    def load_legacy_q_table(self, filename):
+        """Carga una Q-table del formato pickle anterior; el próximo save_q_table la guarda como .npz + .meta.json"""
+        try:
+            with open(filename, 'rb') as f:
+                saved_data = pickle.load(f)
+            # Convertir Q-tables guardadas con formatos anteriores (estado como tupla, dict de acciones)
+            self.q_table = {}
+            for state, q in saved_data['q_table'].items():
+                if isinstance(state, tuple):
+                    state = pack_state(*state)
+                if isinstance(q, dict):
+                    q = np.array([q[a] for a in ACTIONS], dtype=np.float32)
+                self.q_table[state] = q
+            self._q_sum = sum(float(q.sum()) for q in self.q_table.values())
+            self._n_values = len(self.q_table) * len(ACTIONS)
+            # Mantener epsilon alto para seguir explorando
+            self.epsilon = max(0.2, saved_data.get('epsilon', self.epsilon) * 0.98)  # Reducción más lenta
+            self.training_runs = saved_data.get('training_runs', 0)
+            print(f"🔄 Camión {self.truck_id}: Q-table cargada desde {filename} con {len(self.q_table)} estados, epsilon={self.epsilon:.3f}")
+        except Exception as e:
+            print(f"⚠️ Error cargando Q-table para camión {self.truck_id}: {e}")
                 
     def save_q_table(self):
         """Guarda la Q-table en archivo"""
-        filename = f"q_table_truck_{self.truck_id}.pkl"
         try:
-            # Leer datos previos si existen
-            training_runs = 1
-            if os.path.exists(filename):
-                with open(filename, 'rb') as f:
-                    old_data = pickle.load(f)
-                    training_runs = old_data.get('training_runs', 0) + 1
+            # El contador de ejecuciones se leyó en load_q_table; no hace falta releer el archivo
+            self.training_runs += 1
+            states = np.fromiter(self.q_table.keys(), dtype=np.int64, count=len(self.q_table))
+            if self.q_table:
+                q_values = np.stack(list(self.q_table.values()))
+            else:
+                q_values = np.zeros((0, len(ACTIONS)), dtype=np.float32)
             
-            with open(filename, 'wb') as f:
-                pickle.dump({
-                    'q_table': self.q_table,
-                    'epsilon': self.epsilon,
-                    'training_runs': training_runs
-                }, f)
-            print(f"💾 Camión {self.truck_id}: Q-table guardada con {len(self.q_table)} estados (ejecución #{training_runs})")
+            # Escribir a archivos temporales y reemplazar con os.replace (atómico): si el proceso muere
+            # a mitad de la escritura, el .npz y el .meta.json anteriores siguen intactos.
+            # El .npz se reemplaza primero, así que un .meta.json nuevo siempre tiene su .npz nuevo al lado
+            base = f"q_truck_{self.truck_id}"
+            with open(f"{base}.npz.tmp", 'wb') as f:  # Con archivo abierto savez no agrega otra extensión
+                np.savez_compressed(f, states=states, qvals=q_values)
+            with open(f"{base}.meta.json.tmp", 'w') as f:
+                json.dump({'epsilon': self.epsilon, 'training_runs': self.training_runs}, f)
+            os.replace(f"{base}.npz.tmp", f"{base}.npz")
+            os.replace(f"{base}.meta.json.tmp", f"{base}.meta.json")
+            print(f"💾 Camión {self.truck_id}: Q-table guardada con {len(self.q_table)} estados (ejecución #{self.training_runs})")
         except Exception as e:
             print(f"⚠️ Error guardando Q-table para camión {self.truck_id}: {e}")
 
     def state(self):
-        return (self.position, self.load)
+        return pack_state(self.position, self.load)
 
     def possible_actions(self):
-        return ["up", "down", "left", "right", "collect", "change_route"]
+        return self.POSSIBLE_ACTIONS
 
-    def choose_action(self, state):
+    def choose_action(self, state, critical_positions):
         # Prioridad 1: Si hay contenedor en la posición actual, recolectar
         container_at_position = self.model.get_container_at_position(self.position)
         if (container_at_position and 
@@ -102,31 +207,27 @@ class TrashTruckAgent(ap.Agent):
             return "collect"
         
         # Prioridad 2: Si está lleno, buscar punto de descarga (esquinas)
-        if self.load >= self.capacity * 0.8:  # Descargar cuando esté al 80%
+        if self.load >= self._dump_thr:
             return self.move_to_dump()
         
         # Prioridad 3: Ir hacia el contenedor más crítico
-        critical_containers = self.model.get_critical_containers()
-        if critical_containers:
-            return self.move_to_critical(critical_containers)
+        if len(critical_positions):
+            return self.move_to_critical(critical_positions)
         
-        # Decisión Q-Learning solo si no hay prioridades urgentes
-        if random.uniform(0, 1) < self.epsilon:
-            return random.choice(self.possible_actions())
+        # Decisión Q-Learning solo si no hay prioridades urgentes (números aleatorios pre-generados por el modelo)
+        random_action = self.POSSIBLE_ACTIONS[self.model.truck_random_action[self.truck_id]]
+        if self.model.truck_explore_coin[self.truck_id] < self.epsilon:
+            return random_action
         else:
-            return max(
-                self.q_table.get(state, {}),
-                key=self.q_table.get(state, {}).get,
-                default=random.choice(self.possible_actions())
-            )
+            q_values = self.q_table.get(state)
+            if q_values is None:
+                return random_action
+            return ACTIONS[int(q_values.argmax())]
     
     def move_to_dump(self):
         """Moverse hacia el punto de descarga más cercano (esquinas)"""
         x, y = self.position
-        dump_points = [(0, 0), (7, 0), (0, 7), (7, 7)]
-        closest_dump = min(dump_points, key=lambda p: abs(x - p[0]) + abs(y - p[1]))
-        
-        target_x, target_y = closest_dump
+        target_x, target_y = self.model.closest_dump[x, y]
         if x < target_x: return "right"
         elif x > target_x: return "left"
         elif y < target_y: return "up"
@@ -136,13 +237,12 @@ class TrashTruckAgent(ap.Agent):
             self.load = 0  # Simular descarga
             return "collect"  # Acción dummy
     
-    def move_to_critical(self, critical_containers):
+    def move_to_critical(self, critical_positions):
         """Moverse hacia el contenedor crítico más cercano"""
         x, y = self.position
-        closest_critical = min(critical_containers, 
-                             key=lambda p: abs(x - p[0]) + abs(y - p[1]))
+        _, closest_idx = manhattan_min_and_argmin(x, y, critical_positions)
         
-        target_x, target_y = closest_critical
+        target_x, target_y = critical_positions[closest_idx]
         if x < target_x: return "right"
         elif x > target_x: return "left"
         elif y < target_y: return "up"
@@ -150,23 +250,34 @@ class TrashTruckAgent(ap.Agent):
         else: return "collect"
 
     def update_q(self, state, action, reward, next_state):
-        if state not in self.q_table:
-            self.q_table[state] = {a: 0 for a in self.possible_actions()}
-        if next_state not in self.q_table:
-            self.q_table[next_state] = {a: 0 for a in self.possible_actions()}
-
-        old_value = self.q_table[state][action]
-        next_max = max(self.q_table[next_state].values())
-        new_value = old_value + self.alpha * (reward + self.gamma * next_max - old_value)
-        self.q_table[state][action] = new_value
+        q_values = self.q_table.get(state)
+        if q_values is None:
+            q_values = self.q_table[state] = np.zeros(len(ACTIONS), dtype=np.float32)
+            self._n_values += len(ACTIONS)
+        next_q_values = self.q_table.get(next_state)
+        if next_q_values is None:
+            next_q_values = self.q_table[next_state] = np.zeros(len(ACTIONS), dtype=np.float32)
+            self._n_values += len(ACTIONS)
+
+        a = ACTION_IDX[action]
+        old_value = q_values[a]
+        next_max = next_q_values.max()
+        q_values[a] = old_value + self.alpha * (reward + self.gamma * next_max - old_value)
+        self._q_sum += float(q_values[a] - old_value)
+
+    def average_q_value(self):
+        """Q-valor promedio de toda la Q-table, sin recorrerla"""
+        return self._q_sum / max(1, self._n_values)
 
     def step(self):
+        # Los contenedores críticos se consultan una sola vez por paso del camión
+        critical_positions = self.model.get_critical_positions()
         state = self.state()
-        action = self.choose_action(state)
-        reward, next_state = self.execute(action)
+        action = self.choose_action(state, critical_positions)
+        reward, next_state = self.execute(action, critical_positions)
         self.update_q(state, action, reward, next_state)
 
-    def execute(self, action):
+    def execute(self, action, critical_positions):
         x, y = self.position
         next_pos = self.position
         reward = 0
@@ -180,10 +291,10 @@ class TrashTruckAgent(ap.Agent):
         elif action == "right" and x < 7:
             next_pos = (x + 1, y)
 
-        critical_containers = self.model.get_critical_containers()
-        if critical_containers:
-            dist_before = min(abs(x - pos[0]) + abs(y - pos[1]) for pos in critical_containers)
-            dist_after = min(abs(next_pos[0] - pos[0]) + abs(next_pos[1] - pos[1]) for pos in critical_containers)
+        closest_idx = -1
+        if len(critical_positions):
+            dist_before, closest_idx = manhattan_min_and_argmin(x, y, critical_positions)
+            dist_after, _ = manhattan_min_and_argmin(next_pos[0], next_pos[1], critical_positions)
 
             if dist_after < dist_before:
                 reward += 2  # Recompensa por acercarse a contenedores críticos
@@ -191,28 +302,24 @@ class TrashTruckAgent(ap.Agent):
         if action == "collect":
             container_at_position = self.model.get_container_at_position(self.position)
             if container_at_position and self.load < self.capacity:
-                if container_at_position.current_fill > 0:
-                    truck_space = self.capacity - self.load
-                    amount_to_collect = min(container_at_position.current_fill, truck_space, 10)  # Recolecta más por acción
-                    collected = container_at_position.collect_trash(amount_to_collect)
+                truck_space = self.capacity - self.load
+                # La cantidad se ajusta al llenado del contenedor dentro de collect_trash, bajo el lock
+                collected, still_critical = container_at_position.collect_trash(min(truck_space, 10))  # Recolecta más por acción
+                if collected > 0:
                     reward += 30 * collected  # Mayor recompensa por recolectar
-                    if container_at_position.is_critical():
+                    if still_critical:
                         reward += 100 * collected  # Mucha mayor recompensa por contenedores críticos
                     self.load += collected
                 else:
-                    reward -= 2  # Menor penalización
+                    reward -= 2  # Menor penalización (contenedor vacío)
             else:
                 reward -= 2  # Menor penalización
 
         if action == "change_route":
-            critical_containers = self.model.get_critical_containers()
-            if critical_containers:
+            # "collect" y "change_route" son excluyentes: el crítico más cercano sigue siendo válido
+            if closest_idx >= 0:
                 current_x, current_y = self.position
-                closest_critical = min(
-                    critical_containers, 
-                    key=lambda pos: abs(current_x - pos[0]) + abs(current_y - pos[1])
-                )
-                target_x, target_y = closest_critical
+                target_x, target_y = critical_positions[closest_idx]
                 if current_x < target_x and current_x < 7:
                     next_pos = (current_x + 1, current_y)
                 elif current_x > target_x and current_x > 0:
@@ -241,44 +348,102 @@ class GarbageEnvironment(ap.Model):
 
     def setup(self):
         self.grid = ap.Grid(self, (8, 8), track_empty=True)
+        self.rng = self.nprandom  # Generador de NumPy de agentpy (respeta la semilla de model.run)
+
+        # Punto de descarga más cercano para cada celda del grid, calculado una sola vez
+        xs, ys = np.meshgrid(np.arange(8), np.arange(8), indexing='ij')
+        dump_dist = np.abs(xs[..., None] - DUMP_POINTS[:, 0]) + np.abs(ys[..., None] - DUMP_POINTS[:, 1])
+        self.closest_dump = DUMP_POINTS[dump_dist.argmin(axis=-1)].astype(np.int8)
 
         # Contenedores fijos y más separados
         container_positions = [(1, 1), (6, 1), (2, 5), (5, 6), (3, 3)]
-        self.containers = ap.AgentList(self, len(container_positions), TrashContainerAgent)
-        for container, pos in zip(self.containers, container_positions):
-            container.position = pos
-            container.current_fill = random.randint(5, 20)
+        n_containers = len(container_positions)
+
+        # Estado de los contenedores en arreglos SoA (un elemento por contenedor)
+        self.container_positions = container_positions
+        self.pos = np.array(container_positions, dtype=np.int32)
+        self.cap = np.full(n_containers, self.p.container_limit, dtype=np.int32)
+        self.critical_thr = 0.9 * self.cap  # Umbral crítico (90% de la capacidad)
+        self.fill = self.rng.integers(5, 21, n_containers, dtype=np.int32)
+
+        self.containers = ap.AgentList(self, [TrashContainerAgent(self, index=i) for i in range(n_containers)])
+
+        # Índice posición -> contenedor (las posiciones no cambian durante la simulación)
+        self._container_by_pos = {c.position: c for c in self.containers}
+        self.update_status_cache()
 
         # Camiones fijos en esquinas más separadas
         start_positions = [(0, 0), (7, 0), (0, 7)]
-        self.trucks = ap.AgentList(self, 3, TrashTruckAgent)
-        for i, (truck, pos) in enumerate(zip(self.trucks, start_positions)):
-            truck.position = pos
-            truck.truck_id = i  # Asignar ID único
+        self.trucks = ap.AgentList(self, [
+            TrashTruckAgent(self, truck_id=i, position=pos) for i, pos in enumerate(start_positions)
+        ])
+
+        # Camiones en paralelo (opcional): con el GIL y solo 3 camiones el modo serial suele ser igual de rápido
+        self.collect_lock = threading.Lock()
+        self._truck_pool = None
+        if self.p.get('parallel_trucks', False):
+            self._truck_pool = ThreadPoolExecutor(max_workers=len(self.trucks))
 
         # Basura inicial
-        self.initial_trash = sum(container.current_fill for container in self.containers)
+        self.initial_trash = int(self.fill.sum())
 
     def step(self):
-        self.containers.step()
-        self.trucks.step()
+        self.generate_trash()
+        self.update_status_cache()
+
+        # Un solo lote de números aleatorios para la exploración de todos los camiones
+        n_trucks = len(self.trucks)
+        self.truck_explore_coin = self.rng.random(n_trucks)
+        self.truck_random_action = self.rng.integers(0, len(ACTIONS), n_trucks)
+        if self._truck_pool is None:
+            self.trucks.step()
+        else:
+            # Cada camión solo escribe su propia Q-table; los contenedores se protegen con collect_lock
+            list(self._truck_pool.map(TrashTruckAgent.step, self.trucks))
+
+    def generate_trash(self):
+        """Genera basura en todos los contenedores con una sola operación vectorizada"""
+        n = len(self.fill)
+        hits = self.rng.binomial(1, self.p.population_density, n)
+        if self.p.population_density >= 0.3:
+            amounts = self.rng.integers(2, 6, n)
+        else:
+            amounts = self.rng.integers(1, 4, n)
+        np.minimum(self.fill + hits * amounts, 2 * self.cap, out=self.fill)
 
     def get_container_at_position(self, position):
-        for container in self.containers:
-            if container.position == position:
-                return container
-        return None
+        return self._container_by_pos.get(position)
     
+    def update_status_cache(self):
+        """Recalcula una vez por paso las listas de contenedores críticos y desbordados"""
+        critical = np.flatnonzero(self.fill >= self.critical_thr)
+        overflowing = np.flatnonzero(self.fill >= self.cap)
+        self._critical_cache = [self.container_positions[i] for i in critical]
+        self._critical_positions_arr = self.pos[critical]
+        self._critical_positions_arr.flags.writeable = False  # Instantánea de solo lectura para los camiones
+        self._overflow_cache = [self.container_positions[i] for i in overflowing]
+
     def get_critical_containers(self):
-        return [container.position for container in self.containers if container.is_critical()]
+        return self._critical_cache
+
+    def get_critical_positions(self):
+        """Posiciones de los contenedores críticos como arreglo Nx2 int32"""
+        return self._critical_positions_arr
     
     def get_overflowing_containers(self):
-        return [container.position for container in self.containers if container.is_overflowing()]
+        return self._overflow_cache
+
+    def close_truck_pool(self):
+        """Cierra los hilos de los camiones en paralelo; también para quien avanza el modelo sin llamar a end()"""
+        if self._truck_pool is not None:
+            self._truck_pool.shutdown()
+            self._truck_pool = None  # Los pasos siguientes, si los hay, vuelven al modo serial
 
     def end(self):
         # Guardar Q-tables al final de la simulación
         for truck in self.trucks:
             truck.save_q_table()
+        self.close_truck_pool()
         
         # Mostrar estadísticas finales
         total_trash_generated = sum(c.current_fill for c in self.containers)
@@ -305,77 +470,19 @@ parameters = {
     'alpha': 0.15,       # Aprendizaje moderado para evitar sobreajuste
     'gamma': 0.9,        # No tan enfocado en el futuro
     'container_limit': 30, # Contenedores medianos
-    'population_density': 0.2  # Generación moderada
+    'population_density': 0.2,  # Generación moderada
+    'parallel_trucks': False  # Ejecutar los pasos de los camiones en un pool de hilos
 }
 
-def realtime_simulation(model, steps=20, delay=0.5):
-    plt.ion()
-    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(14, 6))
-    
-    for step in range(steps):
-        # Gráfico principal de simulación
-        ax1.clear()
-        ax1.grid(True)
-        ax1.set_xlim(-0.5, 7.5)
-        ax1.set_ylim(-0.5, 7.5)
-        ax1.set_xticks(range(8))
-        ax1.set_yticks(range(8))
-        ax1.set_title(f"Simulación de Basura - Paso {step}")
-        
-        # Contenedores con más información
-        critical_count = 0
-        overflow_count = 0
-        total_trash = 0
-        for i, c in enumerate(model.containers):
-            x, y = c.position
-            color = 'red' if c.is_critical() else ('orange' if c.is_overflowing() else 'green')
-            if c.is_critical(): critical_count += 1
-            if c.is_overflowing(): overflow_count += 1
-            total_trash += c.current_fill
-            
-            ax1.scatter(x, y, s=300, c=color, marker='s', edgecolors='black', alpha=0.8)
-            ax1.text(x, y+0.15, f"{c.current_fill}/{c.capacity}", ha='center', fontsize=7, weight='bold')
-            ax1.text(x, y-0.3, f"C{i}", ha='center', fontsize=6, color='black')
-        
-        # Camiones con trayectorias y estado de entrenamiento
-        active_trucks = 0
-        total_load = 0
-        for i, t in enumerate(model.trucks):
-            x, y = t.position
-            total_load += t.load
-            
-            # Color basado en el entrenamiento (epsilon y tamaño de Q-table)
-            q_size = len(t.q_table)
-            if q_size > 50:
-                truck_color = 'darkblue'  # Bien entrenado
-            elif q_size > 20:
-                truck_color = 'blue'      # Moderadamente entrenado
-            else:
-                truck_color = 'lightblue' # Poco entrenado
-            
-            if t.load > 0 or any(t.position != start for start in [(0,0), (7,0), (0,7)]):
-                active_trucks += 1
-                
-            ax1.scatter(x, y, s=250, c=truck_color, marker='o', edgecolors='black', alpha=0.9)
-            ax1.text(x, y-0.35, f"{t.load}", ha='center', fontsize=8, color='white', weight='bold')
-            ax1.text(x+0.3, y+0.3, f"T{i}", ha='center', fontsize=6, color='black')
-            
-            # Mostrar epsilon (exploración vs explotación)
-            ax1.text(x+0.3, y-0.3, f"ε:{t.epsilon:.2f}", ha='center', fontsize=5, color='purple')
-        
-        # Panel de estadísticas detalladas
-        ax2.clear()
-        ax2.axis('off')
-        ax2.set_title("Estadísticas de Entrenamiento", fontsize=12, weight='bold')
-        
-        stats_text = f"""
+# Plantillas del panel de estadísticas (se formatean una vez por render)
+STATS_TMPL = """
 ESTADO DE LA SIMULACIÓN (Paso {step})
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 
 🚛 CAMIONES:
   • Activos: {active_trucks}/3
   • Carga total: {total_load}
-  • Capacidad total: {3 * model.trucks[0].capacity}
+  • Capacidad total: {total_capacity}
 
 📦 CONTENEDORES:
   • Críticos: {critical_count}/5
@@ -383,33 +490,7 @@ ESTADO DE LA SIMULACIÓN (Paso {step})
   • Basura total: {total_trash}
 
 🧠 ENTRENAMIENTO POR CAMIÓN:
-"""
-        
-        for i, truck in enumerate(model.trucks):
-            q_size = len(truck.q_table)
-            avg_q = sum(sum(actions.values()) for actions in truck.q_table.values()) / max(1, q_size * 6) if q_size > 0 else 0
-            
-            # Determinar nivel de entrenamiento
-            if q_size > 50:
-                level = "🟢 EXPERTO"
-            elif q_size > 20:
-                level = "🟡 INTERMEDIO"
-            elif q_size > 5:
-                level = "🟠 NOVATO"
-            else:
-                level = "🔴 SIN ENTRENAR"
-                
-            stats_text += f"""
-Camión {i} ({level}):
-  • Q-Table: {q_size} estados
-  • Q-valor promedio: {avg_q:.2f}
-  • Epsilon: {truck.epsilon:.3f}
-  • Posición: {truck.position}
-  • Carga: {truck.load}/{truck.capacity}
-"""
-        
-        # Explicación del comportamiento
-        stats_text += f"""
+{trucks}
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 🔍 ANÁLISIS:
 • Solo {active_trucks} camiones se mueven porque los
@@ -419,23 +500,131 @@ Camión {i} ({level}):
 • Los camiones aprenden gradualmente qué 
   acciones tomar en cada situación.
 """
-        
-        ax2.text(0.05, 0.95, stats_text, transform=ax2.transAxes, fontsize=8, 
-                verticalalignment='top', fontfamily='monospace')
-        
-        # Leyenda mejorada
-        handles = [
-            plt.Line2D([0], [0], marker='s', color='w', label='Contenedor Normal', markerfacecolor='green', markersize=10, markeredgecolor='black'),
-            plt.Line2D([0], [0], marker='s', color='w', label='Contenedor Crítico', markerfacecolor='red', markersize=10, markeredgecolor='black'),
-            plt.Line2D([0], [0], marker='s', color='w', label='Contenedor Desbordado', markerfacecolor='orange', markersize=10, markeredgecolor='black'),
-            plt.Line2D([0], [0], marker='o', color='w', label='Camión Experto', markerfacecolor='darkblue', markersize=10, markeredgecolor='black'),
-            plt.Line2D([0], [0], marker='o', color='w', label='Camión Novato', markerfacecolor='lightblue', markersize=10, markeredgecolor='black'),
-        ]
-        ax1.legend(handles=handles, loc='upper left', fontsize=8)
-        
-        plt.tight_layout()
-        plt.pause(delay)
+
+TRUCK_STATS_TMPL = """
+Camión {id} ({level}):
+  • Q-Table: {q_size} estados
+  • Q-valor promedio: {avg_q:.2f}
+  • Epsilon: {epsilon:.3f}
+  • Posición: {position}
+  • Carga: {load}/{capacity}
+"""
+
+def realtime_simulation(model, steps=20, delay=0.5, render_every=5):
+    plt.ion()
+    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(14, 6))
+    
+    # Los ejes, la leyenda y los artistas se crean una sola vez; cada render solo actualiza sus datos
+    ax1.grid(True)
+    ax1.set_xlim(-0.5, 7.5)
+    ax1.set_ylim(-0.5, 7.5)
+    ax1.set_xticks(range(8))
+    ax1.set_yticks(range(8))
+    title = ax1.set_title("Simulación de Basura - Paso 0")
+    
+    # Contenedores con más información
+    container_scatter = ax1.scatter(model.pos[:, 0], model.pos[:, 1], s=300, c='green', marker='s', edgecolors='black', alpha=0.8)
+    container_fill_texts = []
+    for i, (x, y) in enumerate(model.container_positions):
+        container_fill_texts.append(ax1.text(x, y+0.15, "", ha='center', fontsize=7, weight='bold'))
+        ax1.text(x, y-0.3, f"C{i}", ha='center', fontsize=6, color='black')
+    
+    # Camiones con trayectorias y estado de entrenamiento
+    truck_scatter = ax1.scatter([t.position[0] for t in model.trucks], [t.position[1] for t in model.trucks],
+                                s=250, c='lightblue', marker='o', edgecolors='black', alpha=0.9)
+    truck_load_texts = [ax1.text(0, 0, "", ha='center', fontsize=8, color='white', weight='bold') for _ in model.trucks]
+    truck_id_texts = [ax1.text(0, 0, f"T{i}", ha='center', fontsize=6, color='black') for i in range(len(model.trucks))]
+    # Mostrar epsilon (exploración vs explotación)
+    truck_epsilon_texts = [ax1.text(0, 0, "", ha='center', fontsize=5, color='purple') for _ in model.trucks]
+    
+    # Leyenda mejorada
+    handles = [
+        plt.Line2D([0], [0], marker='s', color='w', label='Contenedor Normal', markerfacecolor='green', markersize=10, markeredgecolor='black'),
+        plt.Line2D([0], [0], marker='s', color='w', label='Contenedor Crítico', markerfacecolor='red', markersize=10, markeredgecolor='black'),
+        plt.Line2D([0], [0], marker='s', color='w', label='Contenedor Desbordado', markerfacecolor='orange', markersize=10, markeredgecolor='black'),
+        plt.Line2D([0], [0], marker='o', color='w', label='Camión Experto', markerfacecolor='darkblue', markersize=10, markeredgecolor='black'),
+        plt.Line2D([0], [0], marker='o', color='w', label='Camión Novato', markerfacecolor='lightblue', markersize=10, markeredgecolor='black'),
+    ]
+    ax1.legend(handles=handles, loc='upper left', fontsize=8)
+    
+    # Panel de estadísticas detalladas
+    ax2.axis('off')
+    ax2.set_title("Estadísticas de Entrenamiento", fontsize=12, weight='bold')
+    stats_artist = ax2.text(0.05, 0.95, "", transform=ax2.transAxes, fontsize=8, 
+                            verticalalignment='top', fontfamily='monospace')
+    plt.tight_layout()
+    
+    for step in range(steps):
+        # Renderizar solo cada `render_every` pasos; el resto del tiempo es entrenamiento
+        if step % render_every == 0:
+            title.set_text(f"Simulación de Basura - Paso {step}")
+            
+            critical_mask = model.fill >= model.critical_thr
+            overflow_mask = model.fill >= model.cap
+            critical_count = int(critical_mask.sum())
+            overflow_count = int(overflow_mask.sum())
+            total_trash = int(model.fill.sum())
+            container_scatter.set_facecolors(np.where(critical_mask, 'red', np.where(overflow_mask, 'orange', 'green')))
+            for text, fill, capacity in zip(container_fill_texts, model.fill, model.cap):
+                text.set_text(f"{fill}/{capacity}")
+            
+            active_trucks = 0
+            total_load = 0
+            truck_colors = []
+            for i, t in enumerate(model.trucks):
+                x, y = t.position
+                total_load += t.load
+                
+                # Color basado en el entrenamiento (epsilon y tamaño de Q-table)
+                q_size = len(t.q_table)
+                if q_size > 50:
+                    truck_colors.append('darkblue')  # Bien entrenado
+                elif q_size > 20:
+                    truck_colors.append('blue')      # Moderadamente entrenado
+                else:
+                    truck_colors.append('lightblue') # Poco entrenado
+                
+                if t.load > 0 or any(t.position != start for start in [(0,0), (7,0), (0,7)]):
+                    active_trucks += 1
+                
+                truck_load_texts[i].set_position((x, y-0.35))
+                truck_load_texts[i].set_text(f"{t.load}")
+                truck_id_texts[i].set_position((x+0.3, y+0.3))
+                truck_epsilon_texts[i].set_position((x+0.3, y-0.3))
+                truck_epsilon_texts[i].set_text(f"ε:{t.epsilon:.2f}")
+            truck_scatter.set_offsets([t.position for t in model.trucks])
+            truck_scatter.set_facecolors(truck_colors)
+            
+            truck_stats = []
+            for i, truck in enumerate(model.trucks):
+                q_size = len(truck.q_table)
+                avg_q = truck.average_q_value()
+                
+                # Determinar nivel de entrenamiento
+                if q_size > 50:
+                    level = "🟢 EXPERTO"
+                elif q_size > 20:
+                    level = "🟡 INTERMEDIO"
+                elif q_size > 5:
+                    level = "🟠 NOVATO"
+                else:
+                    level = "🔴 SIN ENTRENAR"
+                
+                truck_stats.append(TRUCK_STATS_TMPL.format_map({
+                    'id': i, 'level': level, 'q_size': q_size, 'avg_q': avg_q, 'epsilon': truck.epsilon,
+                    'position': truck.position, 'load': truck.load, 'capacity': truck.capacity,
+                }))
+            
+            stats_text = STATS_TMPL.format_map({
+                'step': step, 'active_trucks': active_trucks, 'total_load': total_load,
+                'total_capacity': 3 * model.trucks[0].capacity, 'critical_count': critical_count,
+                'overflow_count': overflow_count, 'total_trash': total_trash, 'trucks': "".join(truck_stats),
+            })
+            stats_artist.set_text(stats_text)
+            
+            plt.pause(delay)
         model.step()
+    model.close_truck_pool()
     plt.ioff()
     plt.close(fig)
 
@@ -468,15 +657,15 @@ if __name__ == "__main__":
         # Mostrar las mejores acciones aprendidas
         if truck.q_table:
             print(f"   • Top 3 estrategias aprendidas:")
-            top_strategies = sorted(
-                [(state, max(actions.items(), key=lambda x: x[1])) 
-                for state, actions in truck.q_table.items()],
-                key=lambda x: x[1][1], reverse=True
-            )[:3]  # Top 3 estrategias
+            top_strategies = heapq.nlargest(
+                3,  # Top 3 estrategias
+                ((state, q_values.argmax(), q_values.max()) for state, q_values in truck.q_table.items()),
+                key=itemgetter(2)
+            )
             
-            for j, (state, (best_action, value)) in enumerate(top_strategies, 1):
-                pos, load = state
-                print(f"      {j}. En posición {pos} con carga {load}: '{best_action}' (valor: {value:.2f})")
+            for j, (state, best_idx, value) in enumerate(top_strategies, 1):
+                pos, load = unpack_state(state)
+                print(f"      {j}. En posición {pos} con carga {load}: '{ACTIONS[best_idx]}' (valor: {value:.2f})")
         print()
 
     print(f"🗑️ ESTADO FINAL DE LOS CONTENEDORES:")
@@ -534,7 +723,12 @@ if __name__ == "__main__":
     print("=" * 60)
     
     # Verificar si hay Q-tables previas
-    existing_files = [f for f in os.listdir('.') if f.startswith('q_table_truck_') and f.endswith('.pkl')]
+    # Los IDs de los camiones son conocidos (0, 1, 2): basta con comprobar esos archivos
+    # Cuenta también las Q-tables en el formato pickle anterior, que se convierten al cargarlas
+    existing_files = [
+        i for i in range(3)
+        if os.path.exists(f"q_truck_{i}.meta.json") or os.path.exists(f"q_table_truck_{i}.pkl")
+    ]
     if existing_files:
         print(f"📚 Encontradas {len(existing_files)} Q-tables previas - continuando aprendizaje...")
     else:
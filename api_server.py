@@ -1,14 +1,48 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel, Field
+import msgspec
+import numpy as np
 from typing import List, Dict, Any, Optional
 import json
 import asyncio
-import threading
 import time
-from agents2 import GarbageEnvironment, TrashContainerAgent, TrashTruckAgent
+import struct
+import multiprocessing
+from multiprocessing import shared_memory
+from contextlib import asynccontextmanager, suppress
+from collections import deque
+from itertools import islice
+from agents2 import GarbageEnvironment, TrashContainerAgent, TrashTruckAgent, MAX_PACKED_LOAD
 
-app = FastAPI(title="Garbage Collection Simulation API", version="1.0.0")
+try:
+    from numba import njit
+except ImportError:  # Numba es opcional: sin él los kernels corren como NumPy normal
+    def njit(*args, **kwargs):
+        if args and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Detener el proceso de simulación al apagar el servidor
+    await shutdown_simulation()
+
+# Encoder único reutilizado por todas las respuestas y por la caché de snapshots
+json_encoder = msgspec.json.Encoder()
+msgpack_encoder = msgspec.msgpack.Encoder()  # Cabecera del frame binario del WebSocket de Unity
+
+class MsgspecJSONResponse(JSONResponse):
+    """Respuesta JSON serializada directamente con msgspec (hereda de JSONResponse para que OpenAPI la trate como JSON)"""
+
+    def render(self, content: Any) -> bytes:
+        return json_encoder.encode(content)
+
+# msgspec como clase de respuesta por defecto: todas las rutas evitan json.dumps de la stdlib
+app = FastAPI(title="Garbage Collection Simulation API", version="1.0.0", lifespan=lifespan,
+              default_response_class=MsgspecJSONResponse)
 
 # Configurar CORS para permitir conexiones desde Unity
 app.add_middleware(
@@ -19,13 +53,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Modelos Pydantic para las respuestas
-class Position(BaseModel):
+# Structs de msgspec para las respuestas (mucho más baratos de construir y serializar que Pydantic)
+class Position(msgspec.Struct, frozen=True):  # Inmutable: las mismas instancias se comparten entre pasos del historial
     x: float
     y: float
     z: float = 0.0  # Para Unity 3D
 
-class TruckData(BaseModel):
+class TruckData(msgspec.Struct):
     id: int
     position: Position
     load: int
@@ -33,7 +67,7 @@ class TruckData(BaseModel):
     load_percentage: float
     status: str
 
-class ContainerData(BaseModel):
+class ContainerData(msgspec.Struct):
     id: int
     position: Position
     current_fill: int
@@ -43,7 +77,7 @@ class ContainerData(BaseModel):
     is_critical: bool
     is_overflowing: bool
 
-class SimulationData(BaseModel):
+class SimulationData(msgspec.Struct):
     step: int
     trucks: List[TruckData]
     containers: List[ContainerData]
@@ -52,9 +86,50 @@ class SimulationData(BaseModel):
     critical_containers: int
     timestamp: float
 
+# Esquemas OpenAPI de los Structs: las rutas devuelven bytes ya serializados, sin response_model
+# (que volvería a validar cada respuesta), así que el esquema se declara aparte
+(SIMULATION_DATA_SCHEMA,), _msgspec_schema_components = msgspec.json.schema_components(
+    (SimulationData,), ref_template="#/components/schemas/{name}")
+
+def json_response_schema(schema):
+    """Respuesta 200 documentada para una ruta que devuelve JSON serializado con msgspec"""
+    return {200: {"content": {"application/json": {"schema": schema}}}}
+
+_fastapi_openapi = app.openapi
+
+def openapi_with_msgspec_schemas():
+    """Esquema OpenAPI de FastAPI con los componentes de los Structs de msgspec"""
+    if app.openapi_schema is None:
+        schema = _fastapi_openapi()
+        schema.setdefault("components", {}).setdefault("schemas", {}).update(_msgspec_schema_components)
+    return app.openapi_schema
+
+app.openapi = openapi_with_msgspec_schemas
+
+# Frame binario del WebSocket de Unity:
+#   [longitud de la cabecera:u32][cabecera msgpack (UnityFrameHeader)][camiones][contenedores]
+# Camiones y contenedores son arreglos int16 little-endian de (n, 5) con columnas id, px, pz, pct, estado.
+# Posiciones en centésimas de unidad de Unity, porcentajes * 2.55 y estados como códigos enteros
+# (Unity los reconstruye con pos / 100 y pct / 2.55). pct / 2.55 puede pasar de 100: un contenedor
+# desbordado llega hasta el 200% de su capacidad (510).
+POSITION_QUANT = 100
+TRUCK_STATUS_CODES = {"empty": 0, "collecting": 1, "half_full": 2, "full": 3}
+CONTAINER_STATUS_CODES = {"normal": 0, "medium": 1, "critical": 2, "overflowing": 3}
+WIRE_DTYPE = np.dtype("<i2")
+UNITY_HEADER_LEN = struct.Struct("<I")
+
+class UnityFrameHeader(msgspec.Struct):
+    step: int
+    n_trucks: int
+    n_containers: int
+    efficiency: float
+    critical_containers: int
+    is_running: bool
+
+# La configuración sigue en Pydantic: FastAPI la valida como cuerpo de la petición
 class SimulationConfig(BaseModel):
     steps: int = 1000
-    capacity: int = 1000
+    capacity: int = Field(1000, gt=0, le=MAX_PACKED_LOAD)  # La carga ocupa 16 bits en los estados de la Q-table
     epsilon: float = 0.1
     alpha: float = 0.1
     gamma: float = 0.9
@@ -62,99 +137,310 @@ class SimulationConfig(BaseModel):
     population_density: float = 0.1
     simulation_speed: float = 1.0  # Velocidad de la simulación (pasos por segundo)
 
+# Decoder de los frames que publica el proceso de simulación
+json_decoder = msgspec.json.Decoder(SimulationData)
+
+# La simulación corre en un proceso aparte ("spawn" funciona igual en Linux, macOS y Windows)
+mp_context = multiprocessing.get_context("spawn")
+SHM_SIZE = 1 << 20  # Memoria compartida para un frame: [longitud json:u32][longitud arreglos:u32][json][arreglos Unity]
+STOP_TIMEOUT = 5.0  # Espera máxima a que el proceso salga solo antes de terminarlo
+START_TIMEOUT = 30.0  # Espera máxima al primer frame al iniciar (el proceso importa y crea el modelo)
+FRAME_HEADER = struct.Struct("<II")
+
 # Variables globales para manejar la simulación
-current_simulation = None
-simulation_thread = None
-simulation_running = False
-simulation_data_history = []
+simulation_process = None
+frame_ready = None  # mp.Event que el proceso de simulación activa en cada frame nuevo
+stop_event = None  # mp.Event de la simulación actual: activado = detenida (o terminada)
+simulation_task = None
+first_frame_event = None  # asyncio.Event que se activa al recibir el primer frame de la simulación actual
+HISTORY_SIZE = 100  # Mantener solo los últimos 100 pasos en memoria
+simulation_data_history = deque(maxlen=HISTORY_SIZE)
+simulation_data_by_step = {}  # Índice número de paso -> datos, sincronizado con el historial
+latest_snapshot = None  # Último paso publicado; se reemplaza de una vez, los lectores solo toman la referencia
+cached_json = None  # latest_snapshot serializado (bytes)
+cached_unity_json = None  # Vista para Unity de latest_snapshot serializada (bytes)
+latest_unity_arrays = None  # Arreglos int16 de camiones y contenedores de latest_snapshot (bytes)
+cached_unity_frame = None  # Frame binario para el WebSocket (cabecera msgpack + arreglos)
+new_frame_event = asyncio.Event()  # Se activa y se reemplaza con cada frame nuevo para los WebSocket de Unity
 current_step = 0
+container_positions_3d = []  # Posición 3D de cada contenedor; no se mueven, se calculan al iniciar
+truck_positions_3d = {}  # Celda del grid -> posición 3D de un camión en esa celda
+truck_capacity = np.zeros(0, dtype=np.int32)  # Capacidad de cada camión; fija durante la simulación
+truck_pct_scale = np.zeros(0)  # 100 / capacidad de cada camión: el porcentaje queda en una multiplicación
+container_pct_scale = np.zeros(0)  # 100 / capacidad de cada contenedor
+
+# Escala de las posiciones para Unity (puedes ajustar estos valores)
+POSITION_SCALE = 5.0  # Espaciado entre posiciones
+TRUCK_HEIGHT = 0.5  # Y es altura en Unity: camiones ligeramente elevados, contenedores en el suelo
+
+def precompute_positions_3d(model):
+    """Calcula una sola vez las posiciones 3D de contenedores y de cada celda que puede ocupar un camión"""
+    global container_positions_3d, truck_positions_3d
+    container_positions_3d = [
+        Position(x=x * POSITION_SCALE, y=0.0, z=y * POSITION_SCALE)
+        for x, y in model.container_positions
+    ]
+    width, height = model.grid.shape
+    truck_positions_3d = {
+        (x, y): Position(x=x * POSITION_SCALE, y=TRUCK_HEIGHT, z=y * POSITION_SCALE)
+        for x in range(width) for y in range(height)
+    }
+
+# Estado del camión por índice: 0 = vacío, si no (load_percentage // 10) + 1 (>= 50% medio lleno, >= 90% lleno)
+_TRUCK_STATUS = ("empty",) + ("collecting",) * 5 + ("half_full",) * 4 + ("full",) * 2
+# Estado del contenedor por clave (desbordado << 2) | (crítico << 1) | (llenado >= 70%)
+_CONTAINER_STATUS = ("normal", "medium") + ("critical",) * 2 + ("overflowing",) * 4
+# Las mismas tablas con los códigos de estado del frame binario de Unity
+_TRUCK_STATUS_WIRE = np.array([TRUCK_STATUS_CODES[status] for status in _TRUCK_STATUS], dtype=WIRE_DTYPE)
+_CONTAINER_STATUS_WIRE = np.array([CONTAINER_STATUS_CODES[status] for status in _CONTAINER_STATUS], dtype=WIRE_DTYPE)
 
-def convert_position_to_3d(position_2d, agent_type="truck"):
-    """Convierte posición 2D del modelo a coordenadas 3D para Unity"""
-    x, y = position_2d
-    # Escalar las posiciones para Unity (puedes ajustar estos valores)
-    scale = 5.0  # Espaciado entre posiciones
+def precompute_capacity_scales(model):
+    """Guarda una sola vez las capacidades de los camiones y los factores 100 / capacidad de camiones y contenedores"""
+    global truck_capacity, truck_pct_scale, container_pct_scale
+    truck_capacity = np.fromiter((truck.capacity for truck in model.trucks), dtype=np.int32, count=len(model.trucks))
+    truck_pct_scale = 100.0 / truck_capacity
+    container_pct_scale = 100.0 / model.cap
+
+def _sync_soa(model):
+    """Copia una vez por paso la carga de los camiones a un arreglo NumPy"""
+    return np.fromiter((truck.load for truck in model.trucks), dtype=np.int32, count=len(model.trucks))
+
+@njit(cache=True)
+def _compute_step_stats(truck_load, truck_capacity, truck_pct_scale, container_fill, container_capacity,
+                        container_pct_scale, critical_thr):
+    """Porcentajes, máscaras, índices de estado y totales de un paso en una sola llamada compilada"""
+    load_pct = truck_load * truck_pct_scale
+    fill_pct = container_fill * container_pct_scale
+    critical_mask = container_fill >= critical_thr
+    overflow_mask = container_fill >= container_capacity
     
-    # Y es altura en Unity, mantenemos en 0 para objetos en el suelo
-    z_offset = 0.5 if agent_type == "truck" else 0.0  # Camiones ligeramente elevados
+    # Índices en _TRUCK_STATUS y _CONTAINER_STATUS; la décima de carga sale exacta de enteros
+    truck_status_idx = (np.minimum(10 * truck_load // truck_capacity, 10).astype(np.int8) + 1) * (truck_load > 0)
+    container_status_idx = (overflow_mask.astype(np.int8) << 2) | (critical_mask.astype(np.int8) << 1) \
+        | (container_fill >= 0.7 * container_capacity)
     
-    return Position(
-        x=x * scale,
-        y=z_offset,
-        z=y * scale
-    )
+    total_collected = truck_load.sum()
+    total_in_system = container_fill.sum() + total_collected
+    efficiency = total_collected / total_in_system * 100 if total_in_system > 0 else 0.0
+    critical_count = np.count_nonzero(critical_mask)
+    return (load_pct, fill_pct, critical_mask, overflow_mask, truck_status_idx, container_status_idx,
+            total_collected, efficiency, critical_count)
 
-def get_truck_status(truck):
-    """Determina el estado del camión basado en su carga"""
-    load_percentage = (truck.load / truck.capacity) * 100
-    if load_percentage >= 90:
-        return "full"
-    elif load_percentage >= 50:
-        return "half_full"
-    elif truck.load > 0:
-        return "collecting"
-    else:
-        return "empty"
-
-def get_container_status(container):
-    """Determina el estado del contenedor basado en su llenado"""
-    if container.is_overflowing():
-        return "overflowing"
-    elif container.is_critical():
-        return "critical"
-    elif container.current_fill >= 0.7 * container.capacity:
-        return "medium"
-    else:
-        return "normal"
+def pack_wire_rows(cells, percentages, status_codes):
+    """Filas int16 [id, px, pz, pct, estado] del frame binario de Unity a partir de arreglos por agente"""
+    rows = np.empty((len(cells), 5), dtype=WIRE_DTYPE)
+    rows[:, 0] = np.arange(len(cells))
+    rows[:, 1:3] = cells * round(POSITION_SCALE * POSITION_QUANT)
+    rows[:, 3] = np.clip(np.rint(percentages * 2.55), 0, np.iinfo(WIRE_DTYPE).max)
+    rows[:, 4] = status_codes
+    return rows
 
 def extract_simulation_data(model, step_number):
-    """Extrae los datos de la simulación en el formato requerido"""
+    """Extrae los datos de la simulación en el formato requerido y los arreglos binarios para Unity"""
+    
+    # Los contenedores ya viven en arreglos del modelo (fill, cap); los camiones se copian aquí
+    truck_load = _sync_soa(model)
+    # Toda la aritmética del paso (estados con tablas de búsqueda en lugar de un if/elif por agente)
+    (load_pct, fill_pct, critical_mask, overflow_mask, truck_status_idx, container_status_idx,
+     total_trash_collected, efficiency, critical_containers) = _compute_step_stats(
+        truck_load, truck_capacity, truck_pct_scale, model.fill, model.cap, container_pct_scale, model.critical_thr)
     
     # Datos de camiones
-    trucks_data = []
-    for i, truck in enumerate(model.trucks):
-        trucks_data.append(TruckData(
+    trucks_data = [
+        TruckData(
             id=i,
-            position=convert_position_to_3d(truck.position, "truck"),
-            load=truck.load,
-            capacity=truck.capacity,
-            load_percentage=(truck.load / truck.capacity) * 100,
-            status=get_truck_status(truck)
-        ))
+            position=truck_positions_3d[truck.position],
+            load=load,
+            capacity=capacity,
+            load_percentage=load_percentage,
+            status=_TRUCK_STATUS[status_idx]
+        )
+        for i, (truck, load, capacity, load_percentage, status_idx)
+        in enumerate(zip(model.trucks, truck_load.tolist(), truck_capacity.tolist(), load_pct.tolist(),
+                         truck_status_idx.tolist()))
+    ]
     
     # Datos de contenedores
-    containers_data = []
-    for i, container in enumerate(model.containers):
-        containers_data.append(ContainerData(
+    containers_data = [
+        ContainerData(
             id=i,
-            position=convert_position_to_3d(container.position, "container"),
-            current_fill=container.current_fill,
-            capacity=container.capacity,
-            fill_percentage=(container.current_fill / container.capacity) * 100,
-            status=get_container_status(container),
-            is_critical=container.is_critical(),
-            is_overflowing=container.is_overflowing()
-        ))
-    
-    # Calcular estadísticas
-    total_trash_collected = sum(truck.load for truck in model.trucks)
-    total_trash_in_system = sum(container.current_fill for container in model.containers) + total_trash_collected
-    efficiency = (total_trash_collected / total_trash_in_system * 100) if total_trash_in_system > 0 else 0
-    critical_containers = sum(1 for container in model.containers if container.is_critical())
-    
-    return SimulationData(
+            position=position,
+            current_fill=fill,
+            capacity=capacity,
+            fill_percentage=fill_percentage,
+            status=_CONTAINER_STATUS[status_idx],
+            is_critical=crit,
+            is_overflowing=over
+        )
+        for i, (position, fill, capacity, fill_percentage, crit, over, status_idx)
+        in enumerate(zip(container_positions_3d, model.fill.tolist(), model.cap.tolist(), fill_pct.tolist(),
+                         critical_mask.tolist(), overflow_mask.tolist(), container_status_idx.tolist()))
+    ]
+    
+    # Arreglos para el WebSocket de Unity, directamente desde los arreglos del paso
+    truck_cells = np.array([truck.position for truck in model.trucks], dtype=np.int32).reshape(-1, 2)
+    unity_arrays = (
+        pack_wire_rows(truck_cells, load_pct, _TRUCK_STATUS_WIRE[truck_status_idx]).tobytes()
+        + pack_wire_rows(model.pos, fill_pct, _CONTAINER_STATUS_WIRE[container_status_idx]).tobytes()
+    )
+    
+    step_data = SimulationData(
         step=step_number,
         trucks=trucks_data,
         containers=containers_data,
-        total_trash_collected=total_trash_collected,
-        efficiency=efficiency,
-        critical_containers=critical_containers,
+        total_trash_collected=int(total_trash_collected),
+        efficiency=float(efficiency),
+        critical_containers=int(critical_containers),
         timestamp=time.time()
     )
+    return step_data, unity_arrays
+
+def is_simulation_running():
+    """La simulación corre mientras su stop_event no esté activado"""
+    return stop_event is not None and not stop_event.is_set()
+
+def simulation_status():
+    """Estado para la API: starting hasta recibir el primer frame, luego running o stopped"""
+    if not is_simulation_running():
+        return "stopped"
+    return "running" if latest_snapshot is not None else "starting"
+
+def unity_view(step_data):
+    """Formato simplificado para Unity a partir de los datos de un paso"""
+    return {
+        "step": step_data.step,
+        "trucks": [
+            {
+                "id": truck.id,
+                "position": {"x": truck.position.x, "y": truck.position.y, "z": truck.position.z},
+                "load_percentage": truck.load_percentage,
+                "status": truck.status
+            }
+            for truck in step_data.trucks
+        ],
+        "containers": [
+            {
+                "id": container.id,
+                "position": {"x": container.position.x, "y": container.position.y, "z": container.position.z},
+                "fill_percentage": container.fill_percentage,
+                "status": container.status
+            }
+            for container in step_data.containers
+        ],
+        "simulation_stats": {
+            "efficiency": step_data.efficiency,
+            "critical_containers": step_data.critical_containers,
+            "is_running": is_simulation_running()
+        }
+    }
+
+def notify_new_frame():
+    """Despierta a todos los WebSocket que esperan el frame actual y deja un evento nuevo para el siguiente"""
+    global new_frame_event
+    
+    frame_event, new_frame_event = new_frame_event, asyncio.Event()
+    frame_event.set()
 
-def run_simulation_thread(config: SimulationConfig):
-    """Ejecuta la simulación en un hilo separado"""
-    global current_simulation, simulation_running, simulation_data_history, current_step
+def publish_unity_view(step_data):
+    """Serializa la vista para Unity (JSON para HTTP, frame binario para el WebSocket) y avisa a los WebSocket"""
+    global cached_unity_json, cached_unity_frame
+    
+    cached_unity_json = json_encoder.encode(unity_view(step_data))
+    header = msgpack_encoder.encode(UnityFrameHeader(
+        step=step_data.step,
+        n_trucks=len(step_data.trucks),
+        n_containers=len(step_data.containers),
+        efficiency=step_data.efficiency,
+        critical_containers=step_data.critical_containers,
+        is_running=is_simulation_running()
+    ))
+    cached_unity_frame = UNITY_HEADER_LEN.pack(len(header)) + header + latest_unity_arrays
+    notify_new_frame()
+
+def publish_snapshot(step_data, payload, unity_arrays):
+    """Publica el último paso tal como lo serializó el proceso de simulación"""
+    global latest_snapshot, latest_unity_arrays, cached_json
+    
+    # Reemplazar las referencias es atómico: los lectores ven el paso anterior o el nuevo
+    latest_snapshot = step_data
+    latest_unity_arrays = unity_arrays
+    cached_json = payload
+    publish_unity_view(step_data)
+
+def append_to_history(step_data, payload, unity_arrays):
+    """Agrega un paso al historial y a su índice, quitando del índice el paso que el deque descarta"""
+    # Historial, índice e instantánea se modifican solo desde el event loop, igual que los lectores
+    if len(simulation_data_history) == simulation_data_history.maxlen:
+        simulation_data_by_step.pop(simulation_data_history[0].step, None)
+    simulation_data_history.append(step_data)
+    simulation_data_by_step[step_data.step] = step_data
+    publish_snapshot(step_data, payload, unity_arrays)
+
+def write_frame(shm, frame_seq, frame_ready, frame):
+    """Escribe un paso serializado en la memoria compartida y avisa al proceso del servidor"""
+    step_data, unity_arrays = frame
+    payload = json_encoder.encode(step_data)
+    end = FRAME_HEADER.size + len(payload) + len(unity_arrays)
+    if end > shm.size:
+        raise ValueError(f"Frame of {end} bytes does not fit in shared memory")
+    
+    # El contador de secuencia y su lock protegen el frame mientras se copia
+    with frame_seq.get_lock():
+        FRAME_HEADER.pack_into(shm.buf, 0, len(payload), len(unity_arrays))
+        shm.buf[FRAME_HEADER.size:FRAME_HEADER.size + len(payload)] = payload
+        shm.buf[FRAME_HEADER.size + len(payload):end] = unity_arrays
+        frame_seq.value += 1
+    frame_ready.set()
+
+def simulation_worker(parameters, steps, step_delay, shm_name, frame_seq, frame_ready, stop_event):
+    """Proceso hijo: ejecuta el modelo y publica cada paso en la memoria compartida"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        # Crear el modelo
+        model = GarbageEnvironment(parameters)
+        model.sim_setup()  # Crea contenedores y camiones (llama a setup)
+        try:
+            precompute_positions_3d(model)
+            precompute_capacity_scales(model)
+            
+            # Publicar estado inicial
+            write_frame(shm, frame_seq, frame_ready, extract_simulation_data(model, 0))
+            
+            for step in range(1, steps + 1):
+                # Esperar según la velocidad configurada; si el servidor pide parar, salir de inmediato
+                if stop_event.wait(step_delay):
+                    break
+                
+                model.step()
+                write_frame(shm, frame_seq, frame_ready, extract_simulation_data(model, step))
+        finally:
+            model.close_truck_pool()  # El modelo no llega a end() en este recorrido
+    finally:
+        shm.close()
+
+def read_frame(shm, frame_seq, frame_ready, last_seq, timeout):
+    """Espera un frame nuevo y copia sus bytes fuera de la memoria compartida (corre en un hilo de trabajo)"""
+    if not frame_ready.wait(timeout):
+        return last_seq, None
+    frame_ready.clear()
+    
+    # Con timeout: si el proceso hijo murió con el lock tomado no se queda bloqueado
+    lock = frame_seq.get_lock()
+    if not lock.acquire(timeout=timeout):
+        return last_seq, None
+    try:
+        seq = frame_seq.value
+        if seq == last_seq:
+            return seq, None
+        json_length, arrays_length = FRAME_HEADER.unpack_from(shm.buf, 0)
+        json_end = FRAME_HEADER.size + json_length
+        return seq, (bytes(shm.buf[FRAME_HEADER.size:json_end]), bytes(shm.buf[json_end:json_end + arrays_length]))
+    finally:
+        lock.release()
+
+async def run_simulation_loop(config: SimulationConfig):
+    """Lanza el proceso de simulación y pasa cada frame que publica al historial y a la caché"""
+    global simulation_process, frame_ready, simulation_data_history, simulation_data_by_step, current_step, latest_snapshot, latest_unity_arrays, cached_json, cached_unity_json, cached_unity_frame
     
     # Configurar parámetros
     parameters = {
@@ -166,39 +452,58 @@ def run_simulation_thread(config: SimulationConfig):
         'container_limit': config.container_limit,
         'population_density': config.population_density
     }
+    step_delay = 1.0 / config.simulation_speed
     
-    # Crear el modelo
-    current_simulation = GarbageEnvironment(parameters)
-    simulation_data_history = []
+    simulation_data_history = deque(maxlen=HISTORY_SIZE)
+    simulation_data_by_step = {}
+    latest_snapshot = latest_unity_arrays = cached_json = cached_unity_json = cached_unity_frame = None
     current_step = 0
     
-    # Guardar estado inicial
-    initial_data = extract_simulation_data(current_simulation, 0)
-    simulation_data_history.append(initial_data)
-    
-    # Ejecutar simulación paso a paso
-    step_delay = 1.0 / config.simulation_speed
-    
-    for step in range(1, config.steps + 1):
-        if not simulation_running:
-            break
-            
-        # Ejecutar un paso de la simulación
-        current_simulation.step()
-        current_step = step
-        
-        # Extraer datos del paso actual
-        step_data = extract_simulation_data(current_simulation, step)
-        simulation_data_history.append(step_data)
-        
-        # Mantener solo los últimos 100 pasos en memoria
-        if len(simulation_data_history) > 100:
-            simulation_data_history.pop(0)
-        
-        # Esperar según la velocidad configurada
-        time.sleep(step_delay)
+    shm = shared_memory.SharedMemory(create=True, size=SHM_SIZE)
+    frame_seq = mp_context.Value('I', 0)
+    frame_ready = mp_context.Event()
+    simulation_process = mp_context.Process(
+        target=simulation_worker,
+        args=(parameters, config.steps, step_delay, shm.name, frame_seq, frame_ready, stop_event),
+        daemon=True
+    )
+    simulation_process.start()
     
-    simulation_running = False
+    last_seq = 0
+    try:
+        while not stop_event.is_set():
+            # Esperar el siguiente frame en un hilo para no bloquear las peticiones
+            last_seq, frame = await asyncio.to_thread(read_frame, shm, frame_seq, frame_ready, last_seq, 0.5)
+            if frame is not None:
+                payload, unity_arrays = frame
+                step_data = json_decoder.decode(payload)
+                current_step = step_data.step
+                append_to_history(step_data, payload, unity_arrays)
+                first_frame_event.set()
+            elif not simulation_process.is_alive() and frame_seq.value == last_seq:
+                break  # El proceso terminó y no quedan frames por leer
+    finally:
+        # Pide al proceso que salga (si no lo hizo ya) y marca la simulación como detenida
+        stop_event.set()
+        await asyncio.to_thread(simulation_process.join, STOP_TIMEOUT)
+        if simulation_process.is_alive():
+            simulation_process.terminate()
+            await asyncio.to_thread(simulation_process.join)
+        shm.close()
+        shm.unlink()
+        # Volver a serializar la vista de Unity para que refleje is_running=False
+        if latest_snapshot is not None:
+            publish_unity_view(latest_snapshot)
+
+async def shutdown_simulation():
+    """Detiene el proceso de simulación y espera a que la tarea lectora libere la memoria compartida"""
+    if stop_event is not None:
+        stop_event.set()  # El proceso lo ve en su siguiente espera entre pasos
+    if frame_ready is not None:
+        frame_ready.set()  # Despertar al lector para que vea la parada
+    if simulation_task is not None:
+        with suppress(asyncio.CancelledError):
+            await simulation_task
 
 @app.get("/")
 async def root():
@@ -208,33 +513,34 @@ async def root():
 @app.post("/simulation/start")
 async def start_simulation(config: SimulationConfig = SimulationConfig()):
     """Inicia una nueva simulación"""
-    global simulation_thread, simulation_running, current_simulation
+    global simulation_task, stop_event, first_frame_event
     
-    # Detener simulación anterior si existe
-    if simulation_running:
-        simulation_running = False
-        if simulation_thread and simulation_thread.is_alive():
-            simulation_thread.join(timeout=2.0)
+    # Detener simulación anterior si existe (esperar a que termine antes de iniciar la nueva)
+    if simulation_task is not None and not simulation_task.done():
+        await shutdown_simulation()
     
     # Iniciar nueva simulación
-    simulation_running = True
-    simulation_thread = threading.Thread(target=run_simulation_thread, args=(config,))
-    simulation_thread.daemon = True
-    simulation_thread.start()
+    stop_event = mp_context.Event()
+    first_frame_event = asyncio.Event()
+    simulation_task = asyncio.create_task(run_simulation_loop(config))
+    
+    # Esperar el primer frame (el proceso tarda unos segundos en importar y crear el modelo) para que
+    # los datos ya estén disponibles al responder; se deja de esperar si la tarea termina antes
+    first_frame = asyncio.ensure_future(first_frame_event.wait())
+    await asyncio.wait((first_frame, simulation_task), timeout=START_TIMEOUT, return_when=asyncio.FIRST_COMPLETED)
+    first_frame.cancel()
     
     return {
         "message": "Simulation started successfully", 
         "config": config.dict(),
-        "status": "running"
+        "status": simulation_status()
     }
 
 @app.post("/simulation/stop")
 async def stop_simulation():
     """Detiene la simulación actual"""
-    global simulation_running
-    
-    if simulation_running:
-        simulation_running = False
+    if is_simulation_running():
+        await shutdown_simulation()
         return {"message": "Simulation stopped", "status": "stopped"}
     else:
         return {"message": "No simulation running", "status": "idle"}
@@ -242,48 +548,49 @@ async def stop_simulation():
 @app.get("/simulation/status")
 async def get_simulation_status():
     """Obtiene el estado actual de la simulación"""
-    global simulation_running, current_step, current_simulation
+    global current_step, simulation_process, latest_snapshot
     
-    if current_simulation is None:
+    if simulation_process is None:
         return {"status": "not_started", "step": 0}
     
+    # El modelo vive en el proceso de simulación; los totales salen del último frame recibido
+    snapshot = latest_snapshot
     return {
-        "status": "running" if simulation_running else "stopped",
+        "status": simulation_status(),
         "current_step": current_step,
-        "total_trucks": len(current_simulation.trucks),
-        "total_containers": len(current_simulation.containers)
+        "total_trucks": len(snapshot.trucks) if snapshot is not None else 0,
+        "total_containers": len(snapshot.containers) if snapshot is not None else 0
     }
 
-@app.get("/simulation/data/current", response_model=SimulationData)
+@app.get("/simulation/data/current", responses=json_response_schema(SIMULATION_DATA_SCHEMA))
 async def get_current_simulation_data():
     """Obtiene los datos actuales de la simulación"""
-    global current_simulation, current_step, simulation_data_history
+    global simulation_process, cached_json
     
-    if current_simulation is None:
+    if simulation_process is None:
         raise HTTPException(status_code=404, detail="No simulation running")
     
-    if simulation_data_history:
-        return simulation_data_history[-1]
-    else:
-        # Si no hay datos en el historial, generar datos actuales
-        return extract_simulation_data(current_simulation, current_step)
+    if cached_json is None:
+        raise HTTPException(status_code=404, detail="No simulation data available")
+    
+    # Bytes tal como los publicó el proceso de simulación
+    return Response(content=cached_json, media_type="application/json")
 
-@app.get("/simulation/data/step/{step_number}", response_model=SimulationData)
+@app.get("/simulation/data/step/{step_number}", responses=json_response_schema(SIMULATION_DATA_SCHEMA))
 async def get_simulation_data_by_step(step_number: int):
     """Obtiene los datos de un paso específico de la simulación"""
-    global simulation_data_history
+    global simulation_data_history, simulation_data_by_step
     
     if not simulation_data_history:
         raise HTTPException(status_code=404, detail="No simulation data available")
     
-    # Buscar el paso específico
-    for data in simulation_data_history:
-        if data.step == step_number:
-            return data
-    
-    raise HTTPException(status_code=404, detail=f"Step {step_number} not found")
+    data = simulation_data_by_step.get(step_number)
+    if data is None:
+        raise HTTPException(status_code=404, detail=f"Step {step_number} not found")
+    return MsgspecJSONResponse(data)
 
-@app.get("/simulation/data/history")
+@app.get("/simulation/data/history",
+         responses=json_response_schema({"type": "array", "items": SIMULATION_DATA_SCHEMA}))
 async def get_simulation_history(last_n: Optional[int] = 10):
     """Obtiene el historial de los últimos N pasos de la simulación"""
     global simulation_data_history
@@ -292,7 +599,10 @@ async def get_simulation_history(last_n: Optional[int] = 10):
         raise HTTPException(status_code=404, detail="No simulation data available")
     
     # Retornar los últimos N pasos
-    return simulation_data_history[-last_n:] if last_n else simulation_data_history
+    if last_n:
+        start = max(0, len(simulation_data_history) - last_n)
+        return MsgspecJSONResponse(list(islice(simulation_data_history, start, None)))
+    return MsgspecJSONResponse(list(simulation_data_history))
 
 @app.get("/simulation/config/default", response_model=SimulationConfig)
 async def get_default_config():
@@ -303,49 +613,57 @@ async def get_default_config():
 @app.get("/unity/simulation/data")
 async def get_unity_simulation_data():
     """Endpoint optimizado para Unity con datos simplificados"""
-    global current_simulation, current_step, simulation_data_history
+    global simulation_process, cached_unity_json
     
-    if current_simulation is None:
+    if simulation_process is None:
         raise HTTPException(status_code=404, detail="No simulation running")
     
-    if not simulation_data_history:
+    if cached_unity_json is None:
         raise HTTPException(status_code=404, detail="No simulation data available")
     
-    current_data = simulation_data_history[-1]
-    
-    # Formato simplificado para Unity
-    unity_data = {
-        "step": current_data.step,
-        "trucks": [
-            {
-                "id": truck.id,
-                "position": {"x": truck.position.x, "y": truck.position.y, "z": truck.position.z},
-                "load_percentage": truck.load_percentage,
-                "status": truck.status
-            }
-            for truck in current_data.trucks
-        ],
-        "containers": [
-            {
-                "id": container.id,
-                "position": {"x": container.position.x, "y": container.position.y, "z": container.position.z},
-                "fill_percentage": container.fill_percentage,
-                "status": container.status
-            }
-            for container in current_data.containers
-        ],
-        "simulation_stats": {
-            "efficiency": current_data.efficiency,
-            "critical_containers": current_data.critical_containers,
-            "is_running": simulation_running
-        }
-    }
+    # JSON ya serializado una vez por paso de simulación
+    return Response(content=cached_unity_json, media_type="application/json")
+
+@app.websocket("/unity/ws")
+async def unity_websocket(websocket: WebSocket):
+    """Envía a Unity el frame binario una vez por paso de simulación, sin peticiones por frame"""
+    await websocket.accept()
     
-    return unity_data
+    # Unity solo escucha: se vigila receive() para detectar la desconexión aunque no haya frames nuevos
+    client_message = asyncio.ensure_future(websocket.receive())
+    try:
+        if cached_unity_frame is not None:
+            await websocket.send_bytes(cached_unity_frame)
+        
+        while True:
+            frame = asyncio.ensure_future(new_frame_event.wait())
+            await asyncio.wait((frame, client_message), return_when=asyncio.FIRST_COMPLETED)
+            
+            if client_message.done():
+                if client_message.result()["type"] == "websocket.disconnect":
+                    frame.cancel()
+                    break
+                # Los mensajes del cliente se ignoran
+                client_message = asyncio.ensure_future(websocket.receive())
+            
+            if frame.done():
+                await websocket.send_bytes(cached_unity_frame)
+            else:
+                frame.cancel()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        client_message.cancel()
 
 if __name__ == "__main__":
+    import importlib.util
     import uvicorn
+    # uvloop y httptools si están instalados; si no, el loop de asyncio y h11 de siempre
+    loop = "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+    http = "httptools" if importlib.util.find_spec("httptools") else "h11"
     print("🚀 Starting Garbage Collection Simulation API Server...")
     print("📡 Access the API at: http://localhost:8000")
     print("📋 API Documentation at: http://localhost:8000/docs")
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    print(f"⚙️  Event loop: {loop}, HTTP parser: {http}")
+    # Un solo worker: el estado de la simulación vive en este proceso
+    uvicorn.run(app, host="0.0.0.0", port=8000, loop=loop, http=http, workers=1)